@@ -2,8 +2,8 @@ from __future__ import annotations
 
 import hashlib
 import io
-import pickle
-from copy import deepcopy
+import os
+from copy import copy, deepcopy
 from dataclasses import dataclass
 from datetime import date
 from enum import Enum, IntEnum
@@ -13,7 +13,10 @@ import pandas as pd
 from flask import Flask, Response, make_response, request
 from flask_classful import FlaskView, route
 
-from word_ranker import similarity_ranking
+from csv_shards import combine_shards, extract_shards
+from errors import InvalidRequest
+from state_store import StateStore
+from word_ranker import AliasCache, similarity_ranking
 
 
 @dataclass
@@ -80,6 +83,7 @@ class State:
         self.schema_alternatives = {k: [] for k in self.schema.keys()}
         self.alternative_lookup_map = None
         self.update_alternatives_lookup()
+        self.learned_aliases = AliasCache()
 
         data = pd.DataFrame(
             {
@@ -115,6 +119,12 @@ class State:
         self.data = data
         self.pending_df = None
 
+    def __setstate__(self, state: Dict[str, Any]):
+        """Checkpoints written before learned aliases existed start with an empty cache"""
+        self.__dict__.update(state)
+        if "learned_aliases" not in state:
+            self.learned_aliases = AliasCache()
+
     def update_alternatives_lookup(self):
         self.alternative_lookup_map = {}
         for column, alternates in self.schema_alternatives.items():
@@ -125,6 +135,9 @@ class State:
         """Return ordered list of matches here"""
         if name in self.schema or name in self.alternative_lookup_map:
             return {name: 100}
+        learned = self.learned_aliases.get(name)
+        if learned in self.schema:
+            return {learned: 100}
         ranking = similarity_ranking(name, self.get_corpus())
         return {
             column: similarity
@@ -135,6 +148,164 @@ class State:
     def get_corpus(self):
         return set(self.schema.keys()) | set(self.alternative_lookup_map.keys())
 
+    def apply(self, operation: str, payload: Any) -> State:
+        """Return the state after a logged operation, used for commits and for replaying the log"""
+        if operation == "upload":
+            new_state = copy(self)
+            new_state.pending_df = payload
+            return new_state
+        elif operation == "cancel_upload":
+            new_state = copy(self)
+            new_state.pending_df = None
+            return new_state
+        elif operation == "reset":
+            return State()
+        elif operation == "complete_upload":
+            return self.complete_upload(payload)
+        elif operation == "update_schema":
+            return self.update_schema(payload)
+        raise ValueError(f"Unknown operation {operation}")
+
+    def complete_upload(self, actions_configs: Dict[str, Dict[str, str]]) -> State:
+        """Return the state with the pending upload merged into the data, see `SchemaApp.complete_upload`"""
+        new_state = deepcopy(self)
+        if new_state.pending_df is None:
+            raise InvalidRequest("Use upload_csv first")
+        new_columns = [
+            x for x in new_state.pending_df.columns if x not in new_state.schema
+        ]
+        rename_map = {}
+        drop_cols = []
+        for column in new_columns:
+            action_config = actions_configs.get(column)
+            if column in self.alternative_lookup_map:
+                rename_map[column] = self.alternative_lookup_map[column]
+                continue
+            elif action_config is None:
+                raise InvalidRequest(f"Action not specified for column {column}")
+            else:
+                action = Actions[action_config["action"]]
+            if action is Actions.drop:
+                drop_cols.append(column)
+            elif action is Actions.add:
+                dtype = action_config.get("dtype")
+                new_name = action_config.get("new_name")
+                if dtype is None:
+                    raise InvalidRequest("Missing dtype field for action add")
+                if new_name is None:
+                    raise InvalidRequest("Missing new_name field for action add")
+                elif new_name in new_state.schema:
+                    raise InvalidRequest(
+                        f"New column name {new_name} already in schema"
+                    )
+                else:
+                    rename_map[column] = new_name
+                if dtype not in Dtypes.__members__:
+                    raise InvalidRequest(f"Invalid dtype {dtype}")
+                new_state.schema[new_name] = Dtypes[dtype].name
+                new_state.schema_alternatives[new_name] = []
+                new_state.data[new_name] = pd.NA
+            elif action is Actions.map:
+                map_to_name = actions_configs[column].get("map_to_name")
+                if map_to_name is None:
+                    raise InvalidRequest("Missing map_to_name field for action map")
+                elif map_to_name not in new_state.schema:
+                    raise InvalidRequest(
+                        f"map_to_name {map_to_name} not in current schema"
+                    )
+                else:
+                    rename_map[column] = map_to_name
+                    new_state.learned_aliases.record(column, map_to_name)
+        new_state.update_alternatives_lookup()
+        cleaned_new_data = new_state.pending_df.drop(columns=drop_cols).rename(
+            columns=rename_map
+        )
+        new_state.data = pd.concat([new_state.data, cleaned_new_data]).reset_index(
+            drop=True
+        )
+        for col, dtype in new_state.schema.items():
+            new_state.data[col] = Dtypes[dtype].converter(new_state.data[col])
+        assert set(new_state.data.columns) == set(new_state.schema.keys())
+        return new_state
+
+    def update_schema(self, actions: Dict[str, Dict[str, Any]]) -> State:
+        """Return the state with the schema updated, see `SchemaApp.update_schema`"""
+        new_state = deepcopy(self)
+        for column, action_dict in actions.items():
+            action = Actions[action_dict.get("action")]
+            if action is Actions.drop:
+                if column in new_state.schema:
+                    del new_state.schema[column]
+                    del new_state.schema_alternatives[column]
+                    del new_state.data[column]
+                    new_state.learned_aliases.drop_column(column)
+                else:
+                    raise InvalidRequest(f"Invalid column {column}")
+            elif action is Actions.add:
+                if column in new_state.schema:
+                    raise InvalidRequest(f"Column {column} already exists")
+                else:
+                    dtype = action_dict.get("dtype")
+                    alternatives = action_dict.get("alternatives")
+                    if alternatives and set(alternatives) & (
+                        set(new_state.schema) | set(new_state.alternative_lookup_map)
+                    ):
+                        raise InvalidRequest(
+                            f"Alternatives {alternatives} must not already exist as columns or mappings"
+                        )
+                    if dtype is None:
+                        raise InvalidRequest(
+                            f"Invalid dtype {dtype} for column {column}"
+                        )
+                    new_state.schema[column] = Dtypes[dtype].name
+                    new_state.data[column] = pd.NA
+                    new_state.schema_alternatives[column] = alternatives or []
+            elif action is Actions.alter:
+                if column in new_state.schema:
+                    dtype = action_dict.get("dtype")
+                    new_name = action_dict.get("new_name")
+                    alternatives = action_dict.get("alternatives")
+                    if new_name:
+                        if new_name in new_state.schema:
+                            raise InvalidRequest(
+                                f"New name {new_name} for column {column} already exists"
+                            )
+                        new_state.schema[new_name] = new_state.schema[column]
+                        del new_state.schema[column]
+                        new_state.data = new_state.data.rename(
+                            columns={column: new_name}
+                        )
+                        new_state.learned_aliases.rename_column(column, new_name)
+                    else:
+                        new_name = column
+                    if dtype:
+                        if dtype in Dtypes.__members__:
+                            new_state.schema[new_name] = dtype
+                            new_state.data[new_name] = Dtypes[dtype].converter(
+                                new_state.data[new_name]
+                            )
+                        else:
+                            raise InvalidRequest(
+                                f"Invalid dtype {dtype} for column {new_name}"
+                            )
+                    if alternatives:
+                        if set(alternatives) & (
+                            set(new_state.schema)
+                            | set(new_state.alternative_lookup_map)
+                        ):
+                            raise InvalidRequest(
+                                f"Alternatives {alternatives} must not already exist as columns or mappings"
+                            )
+                        new_state.schema_alternatives[new_name] = alternatives
+                else:
+                    raise InvalidRequest(
+                        f"Cannot alter non-existent column {column}"
+                    )
+            else:
+                raise InvalidRequest(f"Invalid action {action} for column {column}")
+            new_state.update_alternatives_lookup()
+        return new_state
+
 
 class SchemaApp(FlaskView):
     def __init__(self):
@@ -185,18 +356,39 @@ class SchemaApp(FlaskView):
             self.load_state()
             return self.handle_csv(pd.read_csv(io.StringIO(request.get_data().decode())))
 
+    @route("/upload_csv_multi", methods=["GET", "POST"])
+    def upload_csv_multi(self) -> Response:
+        """
+        Begin the csv upload process from several csv shards, should upload one or more files called `files`
+
+        Zip and tar archives are expanded to the csvs they contain, and all shards must have the same columns.
+        The shards are parsed in parallel and combined into a single pending upload.
+
+        The response will look something like
+        {"suggestions": {"first_name": ["firstName"]}}
+        """
+        if not authorize(request.authorization):
+            return Responses.unauthorized("Invalid Authorization")
+        if request.method == "GET":
+            return Responses.invalid("GET not supported for upload_csv_multi")
+        try:
+            df = combine_shards(extract_shards(request.files.getlist("files")))
+        except InvalidRequest as e:
+            return Responses.invalid(str(e))
+        self.load_state()
+        return self.handle_csv(df)
+
     def handle_csv(self, df: pd.DataFrame) -> Response:
-        self.state.pending_df = df
+        new_state = store.commit("upload", df)
         response = {"suggestions": {}, "automaps": {}}
-        for column in self.state.pending_df.columns:
+        for column in new_state.pending_df.columns:
             if (
-                column not in self.state.schema
+                column not in new_state.schema
             ):
-                if column not in self.state.alternative_lookup_map:
-                    response["suggestions"][column] = state.get_matches(column)
+                if column not in new_state.alternative_lookup_map:
+                    response["suggestions"][column] = new_state.get_matches(column)
                 else:
-                    response["automaps"][column] = self.state.alternative_lookup_map[column]
-        self.save_state()
+                    response["automaps"][column] = new_state.alternative_lookup_map[column]
         return Responses.ok(response)
 
     @route("/cancel_upload", methods=["GET", "POST"])
@@ -206,9 +398,7 @@ class SchemaApp(FlaskView):
             return Responses.unauthorized("Invalid Authorization")
         if request.method == "GET":
             return Responses.invalid("GET not supported for cancel_upload")
-        self.load_state()
-        self.state.pending_df = None
-        self.save_state()
+        store.commit("cancel_upload")
         return Responses.ok("Upload cancelled")
 
     @route("/get_schema", methods=["GET"])
@@ -251,14 +441,11 @@ class SchemaApp(FlaskView):
     @route("/reset", methods=["GET", "POST"])
     def reset(self) -> Response:
         """Reset data and schema to defaults"""
-        global state
         if request.method == "GET":
             return 400
         if not authorize(request.authorization):
             return Responses.unauthorized("Invalid Authorization")
-        del state
-        state = State()
-        self.save_state()
+        store.commit("reset")
         return Responses.ok("Reset complete")
 
     @route("/complete_upload", methods=["GET", "POST"])
@@ -273,73 +460,17 @@ class SchemaApp(FlaskView):
             "newcol3": {"action": "map", "map_to_name": "signupDate"}
         }
         """
-        global state
         if not authorize(request.authorization):
             return Responses.unauthorized("Invalid Authorization")
         if request.method == "GET":
             return 400
-        self.load_state()
-        new_state = deepcopy(state)
-        if new_state.pending_df is None:
-            return Responses.invalid("Use upload_csv first")
         actions_configs = request.get_json()
         if not isinstance(actions_configs, dict):
             return Responses.invalid("Need json actions map, see documentation")
-        new_columns = [
-            x for x in new_state.pending_df.columns if x not in new_state.schema
-        ]
-        rename_map = {}
-        drop_cols = []
-        for column in new_columns:
-            action_config = actions_configs.get(column)
-            if column in self.state.alternative_lookup_map:
-                rename_map[column] = self.state.alternative_lookup_map[column]
-            elif action_config is None:
-                Responses.invalid(f"Action not specified for column {column}")
-            else:
-                action = Actions[action_config["action"]]
-            if action is Actions.drop:
-                drop_cols.append(column)
-            elif action is Actions.add:
-                dtype = action_config.get("dtype")
-                new_name = action_config.get("new_name")
-                if dtype is None:
-                    return Responses.invalid("Missing dtype field for action add")
-                if new_name is None:
-                    return Responses.invalid("Missing new_name field for action add")
-                elif new_name in new_state.schema:
-                    return Responses.invalid(
-                        f"New column name {new_name} already in schema"
-                    )
-                else:
-                    rename_map[column] = new_name
-                if dtype not in Dtypes.__members__:
-                    return Responses.invalid(f"Invalid dtype {dtype}")
-                new_state.schema[new_name] = Dtypes[dtype].name
-                new_state.schema_alternatives[new_name] = []
-                new_state.data[new_name] = pd.NA
-            elif action is Actions.map:
-                map_to_name = actions_configs[column].get("map_to_name")
-                if map_to_name is None:
-                    return Responses.invalid("Missing map_to_name field for action map")
-                elif map_to_name not in new_state.schema:
-                    return Responses.invalid(
-                        f"map_to_name {map_to_name} not in current schema"
-                    )
-                else:
-                    rename_map[column] = map_to_name
-        new_state.update_alternatives_lookup()
-        cleaned_new_data = new_state.pending_df.drop(columns=drop_cols).rename(
-            columns=rename_map
-        )
-        new_state.data = pd.concat([new_state.data, cleaned_new_data]).reset_index(
-            drop=True
-        )
-        for col, dtype in new_state.schema.items():
-            new_state.data[col] = Dtypes[dtype].converter(new_state.data[col])
-        assert set(new_state.data.columns) == set(new_state.schema.keys())
-        state = new_state
-        self.save_state()
+        try:
+            store.commit("complete_upload", actions_configs)
+        except InvalidRequest as e:
+            return Responses.invalid(str(e))
         return Responses.ok("Upload complete")
 
     @route("/update_schema", methods=["GET", "POST"])
@@ -365,103 +496,23 @@ class SchemaApp(FlaskView):
             }
         }
         """
-        global state
         if not authorize(request.authorization):
             return Responses.unauthorized("Invalid Authorization")
         if request.method == "GET":
             return 400
-        self.load_state()
-        new_state = deepcopy(self.state)
-        for column, action_dict in request.get_json().items():
-            action = Actions[action_dict.get("action")]
-            if action is Actions.drop:
-                if column in new_state.schema:
-                    del new_state.schema[column]
-                    del new_state.schema_alternatives[column]
-                    del new_state.data[column]
-                else:
-                    return Responses.invalid(f"Invalid column {column}")
-            elif action is Actions.add:
-                if column in new_state.schema:
-                    return Responses.invalid(f"Column {column} already exists")
-                else:
-                    dtype = action_dict.get("dtype")
-                    alternatives = action_dict.get("alternatives")
-                    if alternatives and set(alternatives) & (
-                        set(new_state.schema) | set(new_state.alternative_lookup_map)
-                    ):
-                        return Responses.invalid(
-                            f"Alternatives {alternatives} must not already exist as columns or mappings"
-                        )
-                    if dtype is None:
-                        return Responses.invalid(
-                            f"Invalid dtype {dtype} for column {column}"
-                        )
-                    new_state.schema[column] = Dtypes[dtype].name
-                    new_state.data[column] = pd.NA
-                    new_state.schema_alternatives[column] = alternatives or []
-            elif action is Actions.alter:
-                if column in new_state.schema:
-                    dtype = action_dict.get("dtype")
-                    new_name = action_dict.get("new_name")
-                    alternatives = action_dict.get("alternatives")
-                    if new_name:
-                        if new_name in new_state.schema:
-                            return Responses.invalid(
-                                f"New name {new_name} for column {column} already exists"
-                            )
-                        new_state.schema[new_name] = new_state.schema[column]
-                        del new_state.schema[column]
-                        new_state.data = new_state.data.rename(
-                            columns={column: new_name}
-                        )
-                    else:
-                        new_name = column
-                    if dtype:
-                        if dtype in Dtypes.__members__:
-                            new_state.schema[new_name] = dtype
-                            new_state.data[new_name] = Dtypes[dtype].converter(
-                                new_state.data[new_name]
-                            )
-                        else:
-                            return Responses.invalid(
-                                f"Invalid dtype {dtype} for column {new_name}"
-                            )
-                    if alternatives:
-                        if set(alternatives) & (
-                            set(new_state.schema)
-                            | set(new_state.alternative_lookup_map)
-                        ):
-                            return Responses.invalid(
-                                f"Alternatives {alternatives} must not already exist as columns or mappings"
-                            )
-                        new_state.schema_alternatives[new_name] = alternatives
-                else:
-                    return Responses.invalid(
-                        f"Cannot alter non-existent column {column}"
-                    )
-            else:
-                return Responses.invalid(f"Invalid action {action} for column {column}")
-            new_state.update_alternatives_lookup()
-        state = new_state
-        self.save_state()
+        try:
+            store.commit("update_schema", request.get_json())
+        except InvalidRequest as e:
+            return Responses.invalid(str(e))
         return Responses.ok("Schema update complete")
 
     @property
     def state(self) -> State:
-        """helper function to get the state from the global state variable, workaround for flask_classful limitation"""
-        global state
-        return state
+        """helper function to get the state from the global state store, workaround for flask_classful limitation"""
+        return store.state
 
     def load_state(self):
-        global state
-        with open("state.pkl", "rb") as f:
-            state = pickle.load(f)
-
-    def save_state(self):
-        global state
-        with open("state.pkl", "wb") as f:
-            pickle.dump(state, f)
+        store.refresh()
 
 
 valid_users: Dict[str, str] = {
@@ -469,6 +520,6 @@ valid_users: Dict[str, str] = {
 }
 
 app = Flask(__name__)
-state = State()
+store = StateStore(State, State.apply, directory=os.environ.get("STATE_DIR", "."))
+store.recover()
 SchemaApp.register(app, route_base="/")
-SchemaApp.save_state(None)
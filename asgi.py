@@ -0,0 +1,206 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from tempfile import SpooledTemporaryFile
+from typing import Callable, Optional
+
+from uvicorn.middleware.wsgi import build_environ
+
+from app import app
+
+# Views share the module level state store, so by default they run one at a time
+# in each process; request bodies and responses are still moved by the event loop
+executor_workers = int(os.environ.get("ASGI_EXECUTOR_WORKERS", 1))
+max_buffered_bytes = int(os.environ.get("ASGI_MAX_BUFFERED_BYTES", 64 * 1024 * 1024))
+max_body_bytes = int(os.environ.get("ASGI_MAX_BODY_BYTES", 256 * 1024 * 1024))
+spool_bytes = int(os.environ.get("ASGI_SPOOL_BYTES", 1024 * 1024))
+
+
+class ByteBudget:
+    """Bytes of request bodies a worker holds at once, reservations wait until enough is released"""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.available = limit
+        self.condition: Optional[asyncio.Condition] = None
+
+    async def acquire(self, size: int):
+        if size == 0:
+            return
+        if self.condition is None:
+            self.condition = asyncio.Condition()
+        async with self.condition:
+            await self.condition.wait_for(lambda: self.available >= size)
+            self.available -= size
+
+    async def release(self, size: int):
+        if size == 0:
+            return
+        async with self.condition:
+            self.available += size
+            self.condition.notify_all()
+
+
+class SpoolingWSGIMiddleware:
+    """
+    Serve the flask app over ASGI
+
+    The event loop receives each request body into a file that stays in memory up to `spool_bytes` and
+    spills to disk beyond that, then dispatches the view to a bounded executor. Responses go through a
+    bounded queue that the view thread waits on, so a slow reader holds back its own response.
+
+    The in memory part of request bodies is charged to a per worker budget of `max_buffered_bytes`. A
+    body with a Content-Length reserves its in memory share before it is read, a chunked body is
+    charged as it arrives, and the charge is released once the body is spooled. While the budget is
+    used up, bodies wait unread and tcp flow control pushes back on their clients. Requests without a
+    body are never charged. Bodies over `max_body_bytes` get a 413.
+    """
+
+    def __init__(
+        self,
+        app: Callable,
+        workers: int,
+        max_buffered_bytes: int,
+        max_body_bytes: int,
+        spool_bytes: int = 1024 * 1024,
+        send_queue_size: int = 8,
+    ):
+        self.app = app
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.budget = ByteBudget(max_buffered_bytes)
+        self.max_body_bytes = max_body_bytes
+        self.spool_bytes = min(spool_bytes, max_buffered_bytes)
+        self.send_queue_size = send_queue_size
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http":
+            return
+        content_length = self.header(scope, b"content-length")
+        chunked = b"chunked" in (self.header(scope, b"transfer-encoding") or b"").lower()
+        try:
+            content_length = None if content_length is None else int(content_length)
+        except ValueError:
+            await self.reject(send, 400, b"Invalid Content-Length")
+            return
+        if content_length is not None and content_length > self.max_body_bytes:
+            await self.reject(send, 413, b"Request body too large")
+            return
+        with SpooledTemporaryFile(max_size=self.spool_bytes) as body:
+            if not (content_length or chunked):
+                message = await receive()
+                if message["type"] == "http.disconnect":
+                    return
+            elif not await self.spool(receive, send, body, content_length):
+                return
+            body.seek(0)
+            await self.respond(scope, body, send)
+
+    async def spool(self, receive, send, body, content_length: Optional[int]) -> bool:
+        """Receive the request body into `body`, returns False if a response was already sent or the client left"""
+        charged = 0 if content_length is None else min(content_length, self.spool_bytes)
+        await self.budget.acquire(charged)
+        try:
+            received = 0
+            more_body = True
+            while more_body:
+                message = await receive()
+                if message["type"] == "http.disconnect":
+                    return False
+                chunk = message.get("body", b"")
+                received += len(chunk)
+                if received > self.max_body_bytes or (
+                    content_length is not None and received > content_length
+                ):
+                    await self.reject(send, 413, b"Request body too large")
+                    return False
+                in_memory = min(received, self.spool_bytes)
+                if in_memory > charged:
+                    await self.budget.acquire(in_memory - charged)
+                    charged = in_memory
+                body.write(chunk)
+                more_body = message.get("more_body", False)
+            return True
+        finally:
+            await self.budget.release(charged)
+
+    async def respond(self, scope, body, send):
+        environ = build_environ(scope, {}, body)
+        environ["wsgi.input_terminated"] = True
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.send_queue_size)
+
+        def put(message):
+            asyncio.run_coroutine_threadsafe(queue.put(message), loop).result()
+
+        sender = loop.create_task(self.sender(queue, send))
+        try:
+            await loop.run_in_executor(self.executor, self.run_wsgi, environ, put)
+        finally:
+            await queue.put(None)
+            await sender
+
+    def run_wsgi(self, environ, put: Callable):
+        """Run the wsgi app on an executor thread, handing response messages to the event loop"""
+        response_start = {}
+
+        def start_response(status, headers, exc_info=None):
+            response_start.update(
+                type="http.response.start",
+                status=int(status.split(" ", 1)[0]),
+                headers=[
+                    (name.encode("latin1"), value.encode("latin1"))
+                    for name, value in headers
+                ],
+            )
+
+        result = self.app(environ, start_response)
+        try:
+            put(response_start)
+            for chunk in result:
+                if chunk:
+                    put({"type": "http.response.body", "body": chunk, "more_body": True})
+            put({"type": "http.response.body", "body": b"", "more_body": False})
+        finally:
+            if hasattr(result, "close"):
+                result.close()
+
+    @staticmethod
+    async def sender(queue: asyncio.Queue, send):
+        """Send queued messages, draining the rest if the client has gone so the view thread is not stuck"""
+        failed = False
+        while True:
+            message = await queue.get()
+            if message is None:
+                return
+            if not failed:
+                try:
+                    await send(message)
+                except Exception:
+                    failed = True
+
+    @staticmethod
+    def header(scope, name: bytes) -> Optional[bytes]:
+        for key, value in scope.get("headers", []):
+            if key.lower() == name:
+                return value
+        return None
+
+    @staticmethod
+    async def reject(send, status: int, body: bytes):
+        await send(
+            {
+                "type": "http.response.start",
+                "status": status,
+                "headers": [(b"content-type", b"text/plain")],
+            }
+        )
+        await send({"type": "http.response.body", "body": body})
+
+
+asgi_app = SpoolingWSGIMiddleware(
+    app,
+    workers=executor_workers,
+    max_buffered_bytes=max_buffered_bytes,
+    max_body_bytes=max_body_bytes,
+    spool_bytes=spool_bytes,
+)
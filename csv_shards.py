@@ -0,0 +1,154 @@
+import atexit
+import io
+import multiprocessing
+import os
+import tarfile
+import threading
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, List, Optional, Tuple
+
+import pandas as pd
+
+from errors import InvalidRequest
+
+# Kept apart from app so pool processes can import `read_csv_shard` without building the app.
+# The pool is shared by a worker's requests; by default the cores are split between gunicorn workers
+max_upload_bytes = int(os.environ.get("MAX_UPLOAD_BYTES", 256 * 1024 * 1024))
+max_upload_shards = 1000
+shard_pool_workers = int(
+    os.environ.get(
+        "SHARD_POOL_WORKERS",
+        max(1, (os.cpu_count() or 1) // int(os.environ.get("WEB_CONCURRENCY", 1))),
+    )
+)
+shard_pool: Optional[ProcessPoolExecutor] = None
+shard_pool_lock = threading.Lock()
+
+
+def extract_shards(files) -> List[Tuple[str, bytes]]:
+    """
+    Return (name, contents) for each uploaded csv, expanding zip and tar archives
+
+    Raises InvalidRequest for unreadable archives, or once the csvs add up to more than
+    `max_upload_bytes` or `max_upload_shards`
+    """
+    shards = []
+    total_bytes = 0
+
+    def add_shard(name: str, size: int, read: Callable[[], bytes]):
+        nonlocal total_bytes
+        total_bytes += size
+        if total_bytes > max_upload_bytes:
+            raise InvalidRequest(f"Upload exceeds {max_upload_bytes} bytes at {name}")
+        if len(shards) >= max_upload_shards:
+            raise InvalidRequest(
+                f"Upload exceeds {max_upload_shards} csv files at {name}"
+            )
+        shards.append((name, read()))
+
+    for file in files:
+        name = file.filename or "file"
+        try:
+            if name.lower().endswith(".zip"):
+                with zipfile.ZipFile(file.stream) as archive:
+                    for member in archive.infolist():
+                        if not member.is_dir() and member.filename.lower().endswith(
+                            ".csv"
+                        ):
+                            add_shard(
+                                f"{name}/{member.filename}",
+                                member.file_size,
+                                lambda: archive.read(member),
+                            )
+            elif name.lower().endswith((".tar", ".tar.gz", ".tgz")):
+                with tarfile.open(fileobj=file.stream, mode="r:*") as archive:
+                    for member in archive:
+                        if member.isfile() and member.name.lower().endswith(".csv"):
+                            add_shard(
+                                f"{name}/{member.name}",
+                                member.size,
+                                lambda: archive.extractfile(member).read(),
+                            )
+            else:
+                contents = file.read()
+                add_shard(name, len(contents), lambda: contents)
+        except (zipfile.BadZipFile, tarfile.TarError, EOFError) as e:
+            raise InvalidRequest(f"Could not read archive {name}: {e}")
+    return shards
+
+
+def read_csv_shard(contents: bytes) -> pd.DataFrame:
+    """Parse one csv shard, module level so it can run in a process pool"""
+    return pd.read_csv(io.BytesIO(contents))
+
+
+def get_shard_pool() -> ProcessPoolExecutor:
+    """
+    Process pool for parsing csv shards, created on first use in each worker process
+
+    The app process runs an event loop and executor threads, so pool processes come from a
+    forkserver (or are spawned) rather than forked from it
+    """
+    global shard_pool
+    with shard_pool_lock:
+        if shard_pool is None:
+            method = (
+                "forkserver"
+                if "forkserver" in multiprocessing.get_all_start_methods()
+                else "spawn"
+            )
+            shard_pool = ProcessPoolExecutor(
+                max_workers=shard_pool_workers,
+                mp_context=multiprocessing.get_context(method),
+            )
+            atexit.register(shard_pool.shutdown)
+        return shard_pool
+
+
+def parse_shards(shards: List[Tuple[str, bytes]]) -> List[pd.DataFrame]:
+    """Parse csv shards, in parallel when there is more than one, raising InvalidRequest naming a bad shard"""
+    global shard_pool
+    if len(shards) == 1:
+        results = [lambda: read_csv_shard(shards[0][1])]
+    else:
+        try:
+            results = [
+                get_shard_pool().submit(read_csv_shard, contents).result
+                for _, contents in shards
+            ]
+        except BrokenProcessPool:
+            shard_pool = None
+            raise
+    frames = []
+    for (name, _), result in zip(shards, results):
+        try:
+            frames.append(result())
+        except (
+            pd.errors.ParserError,
+            pd.errors.EmptyDataError,
+            UnicodeDecodeError,
+        ) as e:
+            raise InvalidRequest(f"Could not parse {name}: {e}")
+        except BrokenProcessPool:
+            shard_pool = None
+            raise
+    return frames
+
+
+def combine_shards(shards: List[Tuple[str, bytes]]) -> pd.DataFrame:
+    """Parse csv shards into one frame, raising InvalidRequest if their columns differ"""
+    if not shards:
+        raise InvalidRequest("No csv files uploaded")
+    frames = parse_shards(shards)
+    names = [name for name, _ in shards]
+    columns = set(frames[0].columns)
+    mismatched = [
+        name for name, frame in zip(names, frames) if set(frame.columns) != columns
+    ]
+    if mismatched:
+        raise InvalidRequest(
+            f"Columns of {mismatched} do not match columns of {names[0]}"
+        )
+    return pd.concat(frames, ignore_index=True)
@@ -0,0 +1,2 @@
+class InvalidRequest(Exception):
+    """Raised by state operations that reject a request, the message is returned with a 400"""
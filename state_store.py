@@ -0,0 +1,174 @@
+import fcntl
+import os
+import pickle
+import struct
+import threading
+import zlib
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator, Optional, Tuple
+
+# sequence number, payload length, payload crc32
+record_header = struct.Struct(">QII")
+
+
+class StateStore:
+    """
+    Persist a state as a checkpoint plus a write-ahead log of the operations applied since
+
+    Each commit appends one (operation, payload) record to the log and fsyncs it instead of rewriting
+    the whole state. Once the log holds `checkpoint_interval` records or `checkpoint_bytes` bytes, the
+    state is written to a temporary file, renamed over the checkpoint and the log is truncated, so
+    recovery only ever replays the log written since the last checkpoint.
+
+    Records carry sequence numbers, so records already included in a checkpoint are skipped if a crash
+    happens before the log is truncated, and a torn record at the end of the log is discarded.
+    Several processes can share the same files, a lock file serializes commits between them and
+    `refresh` picks up operations committed by other processes. Within a process a mutex serializes
+    threads. A checkpoint that is not a (seq, state) tuple is a bare state written before the log
+    existed, and is loaded as sequence number 0. A log found without a checkpoint is replayed onto
+    the initial state.
+    """
+
+    def __init__(
+        self,
+        initial: Callable[[], Any],
+        apply: Callable[[Any, str, Any], Any],
+        directory: str = ".",
+        checkpoint_interval: int = 100,
+        checkpoint_bytes: int = 64 * 1024 * 1024,
+    ):
+        self.initial = initial
+        self.apply = apply
+        self.checkpoint_path = os.path.join(directory, "state.pkl")
+        self.log_path = os.path.join(directory, "state.wal")
+        self.lock_path = os.path.join(directory, "state.lock")
+        self.checkpoint_interval = checkpoint_interval
+        self.checkpoint_bytes = checkpoint_bytes
+        self.state = None
+        self.seq = 0
+        self.checkpoint_id: Optional[Tuple[int, int, int]] = None
+        self.log_offset = 0
+        self.log_records = 0
+        self.mutex = threading.Lock()
+
+    @contextmanager
+    def lock(self, exclusive: bool) -> Iterator[None]:
+        with self.mutex, open(self.lock_path, "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def recover(self):
+        """Load the checkpoint and replay the log, starting from the initial state if there is no checkpoint"""
+        with self.lock(exclusive=True):
+            if not os.path.exists(self.checkpoint_path):
+                # a log without a checkpoint is replayed onto the initial state before it is checkpointed
+                self.state = self.initial()
+                self.seq = 0
+                self.checkpoint_id = None
+                self.log_offset = 0
+                self.log_records = 0
+                self.catch_up(exclusive=True)
+                self.write_checkpoint()
+            self.catch_up(exclusive=True)
+
+    def refresh(self):
+        """Replay operations committed by other processes since the last refresh or commit"""
+        with self.lock(exclusive=False):
+            self.catch_up(exclusive=False)
+
+    def commit(self, operation: str, payload: Any = None) -> Any:
+        """
+        Apply an operation to the latest state and append it to the log
+
+        Exceptions raised by `apply` propagate and nothing is logged
+        """
+        with self.lock(exclusive=True):
+            self.catch_up(exclusive=True)
+            new_state = self.apply(self.state, operation, payload)
+            body = pickle.dumps((operation, payload), protocol=pickle.HIGHEST_PROTOCOL)
+            with open(self.log_path, "ab") as f:
+                f.write(record_header.pack(self.seq + 1, len(body), zlib.crc32(body)))
+                f.write(body)
+                f.flush()
+                os.fsync(f.fileno())
+                self.log_offset = f.tell()
+            self.state = new_state
+            self.seq += 1
+            self.log_records += 1
+            if (
+                self.log_records >= self.checkpoint_interval
+                or self.log_offset >= self.checkpoint_bytes
+            ):
+                self.write_checkpoint()
+            return new_state
+
+    def catch_up(self, exclusive: bool):
+        """
+        Bring the in memory state up to date with the checkpoint and log, lock must be held
+
+        With the exclusive lock no other process can be mid append, so an incomplete record at the end
+        of the log is left over from a crash and is truncated.
+        """
+        if self.file_id(self.checkpoint_path) != self.checkpoint_id:
+            self.load_checkpoint()
+        if not os.path.exists(self.log_path):
+            return
+        with open(self.log_path, "r+b") as f:
+            f.seek(self.log_offset)
+            while True:
+                header = f.read(record_header.size)
+                if len(header) < record_header.size:
+                    break
+                seq, length, crc = record_header.unpack(header)
+                body = f.read(length)
+                if len(body) < length or zlib.crc32(body) != crc:
+                    break
+                if seq > self.seq:
+                    operation, payload = pickle.loads(body)
+                    self.state = self.apply(self.state, operation, payload)
+                    self.seq = seq
+                self.log_offset = f.tell()
+                self.log_records += 1
+            if exclusive:
+                f.truncate(self.log_offset)
+
+    def load_checkpoint(self):
+        with open(self.checkpoint_path, "rb") as f:
+            checkpoint = pickle.load(f)
+        if isinstance(checkpoint, tuple) and len(checkpoint) == 2:
+            self.seq, self.state = checkpoint
+        else:
+            self.seq, self.state = 0, checkpoint
+        self.checkpoint_id = self.file_id(self.checkpoint_path)
+        self.log_offset = 0
+        self.log_records = 0
+
+    def write_checkpoint(self):
+        """Atomically replace the checkpoint with the current state and empty the log, lock must be held"""
+        tmp_path = f"{self.checkpoint_path}.tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump((self.seq, self.state), f, protocol=pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.checkpoint_path)
+        directory = os.open(os.path.dirname(os.path.abspath(self.checkpoint_path)), os.O_RDONLY)
+        try:
+            os.fsync(directory)
+        finally:
+            os.close(directory)
+        with open(self.log_path, "wb"):
+            pass
+        self.checkpoint_id = self.file_id(self.checkpoint_path)
+        self.log_offset = 0
+        self.log_records = 0
+
+    @staticmethod
+    def file_id(path: str) -> Optional[Tuple[int, int, int]]:
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
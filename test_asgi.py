@@ -0,0 +1,106 @@
+import asyncio
+import base64
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+state_dir = tempfile.mkdtemp()
+os.environ["STATE_DIR"] = state_dir
+
+from asgi import asgi_app  # noqa: E402
+
+# the middleware's byte budget belongs to one event loop, as it would under uvicorn
+loop = asyncio.new_event_loop()
+
+
+def tearDownModule():
+    loop.close()
+    shutil.rmtree(state_dir)
+
+
+async def request(method: str, path: str, chunks=(b"",), headers=()):
+    """Run one request through `asgi_app`, returns (status, body)"""
+    auth = base64.b64encode(b"iterable:cinnamondreams29")
+    scope = {
+        "type": "http",
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": path,
+        "query_string": b"",
+        "headers": [(b"authorization", b"Basic " + auth), *headers],
+        "server": ("testserver", 80),
+        "client": ("127.0.0.1", 1234),
+    }
+    messages = [
+        {"type": "http.request", "body": chunk, "more_body": i < len(chunks) - 1}
+        for i, chunk in enumerate(chunks)
+    ]
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    await asgi_app(scope, receive, send)
+    body = b"".join(m.get("body", b"") for m in sent if m["type"] == "http.response.body")
+    return sent[0]["status"], body
+
+
+def call(method: str, path: str, chunks=(b"",), headers=()):
+    return loop.run_until_complete(request(method, path, chunks, headers))
+
+
+class AsgiTest(TestCase):
+    def test_get(self):
+        status, body = call("GET", "/")
+        self.assertEqual(status, 200)
+        self.assertEqual(body, b"See API documentation")
+
+    def test_upload(self):
+        call("POST", "/reset")
+        chunks = [
+            b"email,firstName,lastName,",
+            b"signupDate\nbob@acme.com,Bob,",
+            b"Jones,2020-12-05",
+        ]
+        length = str(sum(map(len, chunks))).encode()
+        status, body = call(
+            "POST", "/upload_csv_text", chunks, headers=[(b"content-length", length)]
+        )
+        self.assertEqual(status, 200)
+        status, body = call("GET", "/get_pending")
+        self.assertEqual(status, 200)
+        self.assertIn(b"bob@acme.com", body)
+        self.assertEqual(asgi_app.budget.available, asgi_app.budget.limit)
+
+    def test_chunked_upload(self):
+        chunks = [b"email,firstName\n", b"al@acme.com,Al"]
+        status, _ = call(
+            "POST",
+            "/upload_csv_text",
+            chunks,
+            headers=[(b"transfer-encoding", b"chunked")],
+        )
+        self.assertEqual(status, 200)
+        self.assertEqual(asgi_app.budget.available, asgi_app.budget.limit)
+
+    def test_concurrent_gets_skip_budget(self):
+        async def gets():
+            requests = (request("GET", "/get_schema") for _ in range(6))
+            return await asyncio.wait_for(asyncio.gather(*requests), timeout=10)
+
+        asgi_app.budget.available = 0
+        try:
+            results = loop.run_until_complete(gets())
+        finally:
+            asgi_app.budget.available = asgi_app.budget.limit
+        self.assertEqual([status for status, _ in results], [200] * 6)
+
+    def test_body_too_large(self):
+        length = str(asgi_app.max_body_bytes + 1).encode()
+        status, _ = call("POST", "/upload_csv_text", headers=[(b"content-length", length)])
+        self.assertEqual(status, 413)
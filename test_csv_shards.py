@@ -0,0 +1,113 @@
+import io
+import tarfile
+import zipfile
+from unittest import TestCase, mock
+
+from werkzeug.datastructures import FileStorage
+
+import csv_shards
+from csv_shards import combine_shards, extract_shards, parse_shards
+from errors import InvalidRequest
+
+shard0 = b"email,firstName\nbob@acme.com,Bob"
+shard1 = b"firstName,email\nAl,al@acme.com"
+
+
+def upload(name: str, contents: bytes) -> FileStorage:
+    return FileStorage(stream=io.BytesIO(contents), filename=name)
+
+
+def zip_of(**members: bytes) -> bytes:
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w") as f:
+        for name, contents in members.items():
+            f.writestr(name, contents)
+    return archive.getvalue()
+
+
+def tar_of(**members: bytes) -> bytes:
+    archive = io.BytesIO()
+    with tarfile.open(fileobj=archive, mode="w:gz") as f:
+        for name, contents in members.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(contents)
+            f.addfile(info, io.BytesIO(contents))
+    return archive.getvalue()
+
+
+class ExtractShardsTest(TestCase):
+    def test_plain_files(self):
+        shards = extract_shards([upload("a.csv", shard0), upload("b.csv", shard1)])
+        self.assertEqual(shards, [("a.csv", shard0), ("b.csv", shard1)])
+
+    def test_zip(self):
+        contents = zip_of(**{"a.csv": shard0, "b.csv": shard1, "notes.txt": b"skip"})
+        shards = extract_shards([upload("shards.zip", contents)])
+        self.assertEqual(
+            shards, [("shards.zip/a.csv", shard0), ("shards.zip/b.csv", shard1)]
+        )
+
+    def test_tar(self):
+        contents = tar_of(**{"a.csv": shard0, "b.csv": shard1, "notes.txt": b"skip"})
+        shards = extract_shards([upload("shards.tgz", contents)])
+        self.assertEqual(
+            shards, [("shards.tgz/a.csv", shard0), ("shards.tgz/b.csv", shard1)]
+        )
+
+    def test_corrupt_archive(self):
+        for name in ("shards.zip", "shards.tgz"):
+            with self.assertRaisesRegex(InvalidRequest, name):
+                extract_shards([upload(name, b"not an archive")])
+
+    def test_max_upload_bytes(self):
+        with mock.patch.object(csv_shards, "max_upload_bytes", len(shard0) + 1):
+            with self.assertRaisesRegex(InvalidRequest, "shards.zip/b.csv"):
+                extract_shards(
+                    [upload("shards.zip", zip_of(**{"a.csv": shard0, "b.csv": shard1}))]
+                )
+
+    def test_max_upload_shards(self):
+        with mock.patch.object(csv_shards, "max_upload_shards", 1):
+            with self.assertRaisesRegex(InvalidRequest, "b.csv"):
+                extract_shards([upload("a.csv", shard0), upload("b.csv", shard1)])
+
+
+class ParseShardsTest(TestCase):
+    def test_single_shard_in_process(self):
+        with mock.patch.object(csv_shards, "get_shard_pool") as get_shard_pool:
+            frames = parse_shards([("a.csv", shard0)])
+        get_shard_pool.assert_not_called()
+        self.assertEqual(frames[0]["email"].tolist(), ["bob@acme.com"])
+
+    def test_pool(self):
+        frames = parse_shards([("a.csv", shard0), ("b.csv", shard1)])
+        self.assertEqual(
+            [frame["email"].tolist() for frame in frames],
+            [["bob@acme.com"], ["al@acme.com"]],
+        )
+
+    def test_malformed_shard(self):
+        with self.assertRaisesRegex(InvalidRequest, "b.csv"):
+            parse_shards(
+                [("a.csv", shard0), ("b.csv", b"email,firstName\na,b\nc,d,e,f")]
+            )
+        with self.assertRaisesRegex(InvalidRequest, "a.csv"):
+            parse_shards([("a.csv", b"")])
+
+    def test_combine(self):
+        df = combine_shards([("a.csv", shard0), ("b.csv", shard1)])
+        self.assertEqual(df["email"].tolist(), ["bob@acme.com", "al@acme.com"])
+        self.assertEqual(df["firstName"].tolist(), ["Bob", "Al"])
+
+    def test_mismatched_headers(self):
+        with self.assertRaisesRegex(InvalidRequest, "b.csv"):
+            combine_shards(
+                [
+                    ("a.csv", shard0),
+                    ("b.csv", b"email,favorite_color\nal@acme.com,blue"),
+                ]
+            )
+
+    def test_no_shards(self):
+        with self.assertRaises(InvalidRequest):
+            combine_shards([])
@@ -0,0 +1,147 @@
+import os
+import pickle
+import shutil
+import tempfile
+import threading
+import time
+from unittest import TestCase
+
+from state_store import StateStore, record_header
+
+
+def apply(state, operation, payload):
+    if operation == "fail":
+        raise ValueError(payload)
+    return state + [payload]
+
+
+def slow_apply(state, operation, payload):
+    slow_apply.calls += 1
+    time.sleep(0.001)
+    return apply(state, operation, payload)
+
+
+class StateStoreTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def store(self, **kwargs) -> StateStore:
+        store = StateStore(list, apply, directory=self.directory, **kwargs)
+        store.recover()
+        return store
+
+    def log_size(self) -> int:
+        return os.path.getsize(os.path.join(self.directory, "state.wal"))
+
+    def test_commit_then_recover(self):
+        store = self.store()
+        self.assertEqual(store.state, [])
+        store.commit("add", 1)
+        store.commit("add", 2)
+        with self.assertRaises(ValueError):
+            store.commit("fail", 3)
+        self.assertEqual(store.state, [1, 2])
+        recovered = self.store()
+        self.assertEqual(recovered.state, [1, 2])
+        self.assertEqual(recovered.seq, 2)
+
+    def test_torn_record_truncated(self):
+        store = self.store()
+        store.commit("add", 1)
+        size = self.log_size()
+        with open(store.log_path, "ab") as f:
+            f.write(record_header.pack(2, 100, 0)[:5])
+        recovered = self.store()
+        self.assertEqual(recovered.state, [1])
+        self.assertEqual(self.log_size(), size)
+        recovered.commit("add", 2)
+        self.assertEqual(self.store().state, [1, 2])
+
+    def test_bad_crc_record_truncated(self):
+        store = self.store()
+        store.commit("add", 1)
+        size = self.log_size()
+        body = pickle.dumps(("add", 2))
+        with open(store.log_path, "ab") as f:
+            f.write(record_header.pack(2, len(body), 12345) + body)
+        recovered = self.store()
+        self.assertEqual(recovered.state, [1])
+        self.assertEqual(self.log_size(), size)
+
+    def test_crash_before_log_truncated(self):
+        store = self.store(checkpoint_interval=2)
+        store.commit("add", 1)
+        with open(store.log_path, "rb") as f:
+            first_record = f.read()
+        store.commit("add", 2)
+        self.assertEqual(self.log_size(), 0)
+        # the checkpoint was replaced but the log still holds the records it includes
+        with open(store.log_path, "ab") as f:
+            f.write(first_record)
+        recovered = self.store()
+        self.assertEqual(recovered.state, [1, 2])
+        self.assertEqual(recovered.seq, 2)
+
+    def test_checkpoint_interval(self):
+        store = self.store(checkpoint_interval=3)
+        checkpoint_id = store.checkpoint_id
+        store.commit("add", 1)
+        store.commit("add", 2)
+        self.assertEqual(store.checkpoint_id, checkpoint_id)
+        self.assertGreater(self.log_size(), 0)
+        store.commit("add", 3)
+        self.assertNotEqual(store.checkpoint_id, checkpoint_id)
+        self.assertEqual(self.log_size(), 0)
+        with open(store.checkpoint_path, "rb") as f:
+            self.assertEqual(pickle.load(f), (3, [1, 2, 3]))
+
+    def test_refresh_between_stores(self):
+        a = self.store(checkpoint_interval=3)
+        b = self.store(checkpoint_interval=3)
+        a.commit("add", 1)
+        a.commit("add", 2)
+        b.refresh()
+        self.assertEqual(b.state, [1, 2])
+        b.commit("add", 3)
+        a.refresh()
+        self.assertEqual(a.state, [1, 2, 3])
+        a.commit("add", 4)
+        b.refresh()
+        self.assertEqual(b.state, [1, 2, 3, 4])
+
+    def test_concurrent_refresh(self):
+        writer = self.store()
+        reader = StateStore(list, slow_apply, directory=self.directory)
+        reader.recover()
+        slow_apply.calls = 0
+        for i in range(50):
+            writer.commit("add", i)
+        threads = [threading.Thread(target=reader.refresh) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(reader.state, list(range(50)))
+        self.assertEqual(slow_apply.calls, 50)
+
+    def test_legacy_checkpoint(self):
+        with open(os.path.join(self.directory, "state.pkl"), "wb") as f:
+            pickle.dump([1, 2], f)
+        store = self.store()
+        self.assertEqual(store.state, [1, 2])
+        self.assertEqual(store.seq, 0)
+        store.commit("add", 3)
+        self.assertEqual(self.store().state, [1, 2, 3])
+
+    def test_log_without_checkpoint(self):
+        store = self.store()
+        store.commit("add", 1)
+        store.commit("add", 2)
+        os.remove(store.checkpoint_path)
+        recovered = self.store()
+        self.assertEqual(recovered.state, [1, 2])
+        recovered.commit("add", 3)
+        self.assertEqual(self.store().state, [1, 2, 3])
@@ -0,0 +1,45 @@
+from unittest import TestCase
+
+from word_ranker import AliasCache
+
+
+class AliasCacheTest(TestCase):
+    def test_repeated_confirmation(self):
+        cache = AliasCache()
+        cache.record("signup_date", "signupDate")
+        cache.record("signup_date", "signupDate")
+        self.assertEqual(cache.get("signup_date"), "signupDate")
+        self.assertEqual(cache.entries["signup_date"], ("signupDate", 2))
+        self.assertIsNone(cache.get("unknown"))
+
+    def test_conflicting_confirmation(self):
+        cache = AliasCache()
+        cache.record("name", "firstName")
+        cache.record("name", "firstName")
+        cache.record("name", "lastName")
+        self.assertEqual(cache.entries["name"], ("firstName", 1))
+        cache.record("name", "lastName")
+        self.assertEqual(cache.entries["name"], ("lastName", 1))
+
+    def test_eviction(self):
+        cache = AliasCache(max_size=3)
+        cache.record("a", "x")
+        cache.record("a", "x")
+        cache.record("b", "y")
+        cache.record("c", "z")
+        cache.record("d", "w")
+        self.assertEqual(set(cache.entries), {"a", "c", "d"})
+        cache.record("c", "z")
+        cache.record("e", "v")
+        self.assertEqual(set(cache.entries), {"a", "c", "e"})
+
+    def test_rename_and_drop_column(self):
+        cache = AliasCache()
+        cache.record("signup_date", "signupDate")
+        cache.record("joined", "signupDate")
+        cache.record("mail", "email")
+        cache.rename_column("signupDate", "signedUp")
+        self.assertEqual(cache.get("joined"), "signedUp")
+        self.assertEqual(cache.get("signup_date"), "signedUp")
+        cache.drop_column("email")
+        self.assertIsNone(cache.get("mail"))
@@ -1,4 +1,5 @@
 import io
+import zipfile
 from unittest import TestCase
 
 import pandas as pd
@@ -231,4 +232,97 @@ bob@acme.com,Bob,Jones,2020-12-05,purple,325822"""
                     "signup_date": {"signupDate": 100},
                 }
             },
-        )
\ No newline at end of file
+        )
+
+    def test_upload_multi(self):
+        r = requests.post(self.endpoint("reset"), auth=self.auth)
+        self.assertEqual(r.status_code, 200)
+        shards = [
+            "email,firstName,lastName,signup_date\nbob@acme.com,Bob,Jones,2020-12-05",
+            "lastName,email,firstName,signup_date\nSmith,al@acme.com,Al,2020-12-06",
+        ]
+        r = requests.post(
+            self.endpoint("upload_csv_multi"),
+            files=[("files", (f"shard{i}.csv", shard)) for i, shard in enumerate(shards)],
+            auth=self.auth,
+        )
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(
+            r.json(),
+            {"suggestions": {"signup_date": {"signupDate": 100}}, "automaps": {}},
+        )
+        r = requests.get(self.endpoint("get_pending"), auth=self.auth)
+        self.assertEqual(r.status_code, 200)
+        df = pd.read_csv(io.StringIO(r.text))
+        self.assertEqual(df["email"].tolist(), ["bob@acme.com", "al@acme.com"])
+        r = requests.post(
+            self.endpoint("upload_csv_multi"),
+            files=[
+                ("files", ("shard0.csv", shards[0])),
+                ("files", ("shard1.csv", "email,favorite_color\nal@acme.com,blue")),
+            ],
+            auth=self.auth,
+        )
+        self.assertEqual(r.status_code, 400)
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, "w") as f:
+            for i, shard in enumerate(shards):
+                f.writestr(f"shard{i}.csv", shard)
+        r = requests.post(
+            self.endpoint("upload_csv_multi"),
+            files=[("files", ("shards.zip", archive.getvalue()))],
+            auth=self.auth,
+        )
+        self.assertEqual(r.status_code, 200)
+        r = requests.get(self.endpoint("get_pending"), auth=self.auth)
+        df = pd.read_csv(io.StringIO(r.text))
+        self.assertEqual(df["email"].tolist(), ["bob@acme.com", "al@acme.com"])
+        r = requests.post(
+            self.endpoint("upload_csv_multi"),
+            files=[
+                ("files", ("shard0.csv", shards[0])),
+                ("files", ("shard1.csv", "email,firstName\na,b\nc,d,e,f")),
+            ],
+            auth=self.auth,
+        )
+        self.assertEqual(r.status_code, 400)
+        self.assertIn("shard1.csv", r.text)
+        r = requests.post(
+            self.endpoint("upload_csv_multi"),
+            files=[("files", ("shards.zip", b"not a zip"))],
+            auth=self.auth,
+        )
+        self.assertEqual(r.status_code, 400)
+        self.assertIn("shards.zip", r.text)
+
+    def test_learned_alias(self):
+        r = requests.post(self.endpoint("reset"), auth=self.auth)
+        self.assertEqual(r.status_code, 200)
+        csv = """email,firstName,lastName,joined
+bob@acme.com,Bob,Jones,2020-12-05"""
+        r = requests.post(self.endpoint("upload_csv_text"), data=csv, auth=self.auth)
+        self.assertEqual(r.status_code, 200)
+        r = requests.post(
+            self.endpoint("complete_upload"),
+            json={"joined": {"action": "map", "map_to_name": "signupDate"}},
+            auth=self.auth,
+        )
+        self.assertEqual(r.status_code, 200)
+        r = requests.post(self.endpoint("upload_csv_text"), data=csv, auth=self.auth)
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(
+            r.json(),
+            {"suggestions": {"joined": {"signupDate": 100}}, "automaps": {}},
+        )
+        r = requests.post(
+            self.endpoint("update_schema"),
+            json={"signupDate": {"action": "alter", "new_name": "signedUp"}},
+            auth=self.auth,
+        )
+        self.assertEqual(r.status_code, 200)
+        r = requests.post(self.endpoint("upload_csv_text"), data=csv, auth=self.auth)
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(
+            r.json(),
+            {"suggestions": {"joined": {"signedUp": 100}}, "automaps": {}},
+        )
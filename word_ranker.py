@@ -1,6 +1,6 @@
 import re
 from difflib import SequenceMatcher
-from typing import Dict, List, Set
+from typing import Dict, List, Optional, Set, Tuple
 
 with open("topwords.txt") as word_file:
     cleaned_words: Set[str] = {word.strip().lower() for word in word_file}
@@ -34,5 +34,46 @@ def similarity_ranking(word, corpus) -> Dict[str, int]:
     return match_dict
 
 
+class AliasCache:
+    """
+    Bounded table of header -> column mappings learned from confirmed uploads
+
+    Each header keeps one column and a weight. Confirming the same mapping again increments the weight,
+    a different mapping decrements it and replaces the column once the weight runs out. When the table is
+    full the entry with the lowest weight is evicted, oldest first on ties.
+    """
+
+    def __init__(self, max_size: int = 1000):
+        self.max_size = max_size
+        self.entries: Dict[str, Tuple[str, int]] = {}
+
+    def get(self, header: str) -> Optional[str]:
+        entry = self.entries.get(header)
+        return entry[0] if entry else None
+
+    def record(self, header: str, column: str):
+        entry = self.entries.get(header)
+        if entry is None:
+            if len(self.entries) >= self.max_size:
+                del self.entries[min(self.entries, key=lambda h: self.entries[h][1])]
+            self.entries[header] = (column, 1)
+        elif entry[0] == column:
+            self.entries[header] = (column, entry[1] + 1)
+        elif entry[1] > 1:
+            self.entries[header] = (entry[0], entry[1] - 1)
+        else:
+            self.entries[header] = (column, 1)
+
+    def rename_column(self, column: str, new_name: str):
+        for header, (target, weight) in self.entries.items():
+            if target == column:
+                self.entries[header] = (new_name, weight)
+
+    def drop_column(self, column: str):
+        self.entries = {
+            header: entry for header, entry in self.entries.items() if entry[0] != column
+        }
+
+
 if __name__ == "__main__":
     print(similarity_ranking("foo", ["fo_o", "Foo", "bar", "faz"]))